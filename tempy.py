@@ -13,6 +13,14 @@ USAGE
 >>> func('World')
 'Hello World!'
 
+`render_to()` renders a template directly to a file object:
+
+>>> import io
+>>> buf = io.StringIO()
+>>> render_to(buf, 'Hello {{name}}!', name='World')
+>>> buf.getvalue()
+'Hello World!'
+
 SYNTAX
 -------
 Inline statements are of the form {{...}}. Any single python expression
@@ -47,49 +55,164 @@ respectively:
 '0123456789'
 
 """
-import re
+import os
 import sys
-import inspect
 import signal
+import struct
+import marshal
+import hashlib
 import optparse
+import functools
+import symtable
+import builtins
 
 __license__ = 'MIT'
 __version__ = '0.9.0'
-__all__ = ['compile', 'render']
+__all__ = ['compile', 'render', 'render_to']
 
 
 # Keep a reference to the builtin compile() as we will override the name later
 __compile = compile
 
-
-class Parser(object):
-    _re_tok = r"""
-    # 1: All kinds of python strings
-    ([urbURB]?
-        (?:''(?!') # Empty string
-        | ""(?!") # Empty string
-        | '{6} # Empty string
-        | "{6} # Empty string
-        | '(?:[^\\']|\\.)+?'
-        | "(?:[^\\"]|\\.)+?"
-        | '{3}(?:[^\\]|\\.|\n)+?'{3}
-        | "{3}(?:[^\\]|\\.|\n)+?"{3}
-        )
-    )
-    # 2: Comments (until end of line, but not the newline itself)
-    | (\#.*)
-    # 3, 4: Keywords that start or continue a python block (only start of line)
-    | ^([ \t]*(?:if|for|while|with|try|def|class)\b)
-    | ^([ \t]*(?:elif|else|except|finally)\b)
-    # 5: The special 'end' keyword (but only if it stands alone)
-    | ((?:^|;)[ \t]*end[ \t]*(?=(?:-?%(inline_end)s[ \t]*)?\r?|;|\#))
-    # 6: End of code block token
-    | (-?%(inline_end)s | -?%(block_end)s)
-    # 7: A single newline
-    | (\r?\n)
+_BUILTIN_NAMES = frozenset(dir(builtins))
+
+# Code objects marshalled by another interpreter version are not usable
+_CACHE_HEADER = struct.pack('<II', *sys.version_info[:2])
+
+
+# Keywords that start or continue a python block
+_BLOCK_KEYWORDS = frozenset(['if', 'for', 'while', 'with', 'try', 'def',
+                             'class'])
+_CONT_KEYWORDS = frozenset(['elif', 'else', 'except', 'finally'])
+_STR_PREFIXES = 'urbURB'
+
+
+def _scan_string(src, start):
+    """Scans the python string literal at `start`, returning its end or -1."""
+    n = len(src)
+    i = start
+    if src[i] in _STR_PREFIXES:
+        i += 1
+    q = src[i]
+    # Empty string ('' not followed by a third quote)
+    if src.startswith(q * 2, i) and not src.startswith(q * 3, i):
+        return i + 2
+    # Empty triple-quoted string
+    if src.startswith(q * 6, i):
+        return i + 6
+    if not src.startswith(q * 3, i):
+        # Single-quoted: at least one char, closed by an unescaped quote
+        j = i + 1
+        while j < n:
+            c = src[j]
+            if c == q:
+                return j + 1 if j > i + 1 else -1
+            if c == '\\':
+                if j + 1 >= n or src[j + 1] == '\n':
+                    return -1
+                j += 2
+            else:
+                j += 1
+        return -1
+    # Triple-quoted: at least one char, closed by three quotes
+    j = i + 3
+    first = True
+    while j < n:
+        if not first and src.startswith(q * 3, j):
+            return j + 3
+        if src[j] == '\\':
+            if j + 1 >= n or src[j + 1] == '\n':
+                return -1
+            j += 2
+        else:
+            j += 1
+        first = False
+    return -1
+
+
+def _scan_keyword(src, i):
+    """Matches a block/continuation/'end' keyword at line start `i`."""
+    n = len(src)
+    j = i
+    while j < n and src[j] in ' \t':
+        j += 1
+    k = j
+    while k < n and (src[k].isalnum() or src[k] == '_'):
+        k += 1
+    word = src[j:k]
+    if word in _BLOCK_KEYWORDS:
+        return ('blk1', i, k)
+    if word in _CONT_KEYWORDS:
+        return ('blk2', i, k)
+    if src.startswith('end', j):
+        j += 3
+        while j < n and src[j] in ' \t':
+            j += 1
+        return ('end', i, j)
+    return None
+
+
+def _scan_code_token(src, pos, inline_end, block_end, at_start=False):
+    """Scans for the next code token at or after `pos`.
+
+    Returns (kind, start, end) where kind is one of 'str', 'com',
+    'blk1', 'blk2', 'end', 'cend' or 'nl', or None when the source is
+    exhausted first (non-terminated code block).  `at_start` marks the
+    start of a code region, which behaves like the start of a line for
+    the keyword tokens.
     """
-    _re_split = r'(\\?)((%(inline_start)s-?\s*)|(%(block_start)s-?\s*))'
+    n = len(src)
+    # Newlines are always returned as tokens, so the only position a
+    # line can start at within one scan is the scan position itself.
+    line_start = at_start or pos == 0 or src[pos - 1] == '\n'
+    i = pos
+    while i < n:
+        c = src[i]
+        # Python strings
+        if (c == "'" or c == '"' or
+                (c in _STR_PREFIXES and i + 1 < n and src[i + 1] in '\'"')):
+            end = _scan_string(src, i)
+            if end != -1:
+                return ('str', i, end)
+        # Comments (until end of line, but not the newline itself)
+        if c == '#':
+            end = src.find('\n', i)
+            return ('com', i, end if end != -1 else n)
+        # Keywords that start or continue a python block, and 'end'
+        if line_start and i == pos:
+            tok = _scan_keyword(src, i)
+            if tok is not None:
+                return tok
+        # The 'end' keyword after a semicolon
+        if c == ';':
+            j = i + 1
+            while j < n and src[j] in ' \t':
+                j += 1
+            if src.startswith('end', j):
+                j += 3
+                while j < n and src[j] in ' \t':
+                    j += 1
+                return ('end', i, j)
+        # End of code block token (with optional leading minus)
+        if c == '-':
+            if src.startswith(inline_end, i + 1):
+                return ('cend', i, i + 1 + len(inline_end))
+            if src.startswith(block_end, i + 1):
+                return ('cend', i, i + 1 + len(block_end))
+        if src.startswith(inline_end, i):
+            return ('cend', i, i + len(inline_end))
+        if src.startswith(block_end, i):
+            return ('cend', i, i + len(block_end))
+        # A single newline
+        if c == '\n':
+            return ('nl', i, i + 1)
+        if c == '\r' and src.startswith('\n', i + 1):
+            return ('nl', i, i + 2)
+        i += 1
+    return None
 
+
+class Parser(object):
     def __init__(self, block_start='<%', block_end='%>', inline_start='{{',
                  inline_end='}}', listname='_tempy_out'):
         self.block_start = block_start
@@ -97,116 +220,317 @@ class Parser(object):
         self.inline_start = inline_start
         self.inline_end = inline_end
         self.listname = listname
-        pattern_vars = {'block_start': block_start, 'block_end': block_end,
-                        'inline_start': inline_start, 'inline_end': inline_end}
-        self.re_tok = re.compile(self._re_tok % pattern_vars,
-                                 re.MULTILINE | re.VERBOSE)
-        self.re_split = re.compile(self._re_split % pattern_vars,
-                                   re.MULTILINE)
-        self.out = []  # Output code
+        self.out = []  # Output ops: (kind, indent, payload) tuples
 
     def parse(self, src):
         self._src = src
-        self._text = []  # Text buffer
+        self._text = []  # Text buffer of (start, end) spans into src
         self._text_rstrip = False  # str.rstrip() on the next _flush_text
         self._text_lstrip = False  # str.lstrip() on the next _flush_text
         self._indent_cur = 0  # Current indent level
         self._indent_mod = 0  # Indent level change after _write_line
+        # Keep the hot-loop state in locals; attribute access costs a
+        # dict lookup per use in CPython.
+        inline_start = self.inline_start
+        block_start = self.block_start
+        text = self._text
+        find = src.find
+        pos = 0  # Scan position within src
+        n = len(src)
         while True:
-            m = self.re_split.search(self._src)
-            if m:
-                self._text.append(self._src[:m.start()])
-                self._src = self._src[m.end():]
-                if m.group(1):  # Escaped start block
-                    self._text.append(m.group(2))
-                    continue
-                # Start of code block
-                if m.group(0).rstrip().endswith('-'):
-                    self._text_rstrip = True
-                self._flush_text()
-                self._parse_code(inline=bool(m.group(3)))
-            else:
+            i1 = find(inline_start, pos)
+            i2 = find(block_start, pos)
+            if i1 == -1 and i2 == -1:
                 break
-        self._text.append(self._src)
+            if i1 != -1 and (i2 == -1 or i1 <= i2):
+                d, j, inline = i1, i1 + len(inline_start), True
+            else:
+                d, j, inline = i2, i2 + len(block_start), False
+            if j < n and src[j] == '-':  # Optional minus sign
+                j += 1
+            while j < n and src[j].isspace():
+                j += 1
+            escaped = d > 0 and src[d - 1] == '\\'
+            start = d - 1 if escaped else d
+            if pos != start:  # Do not buffer empty spans
+                text.append((pos, start))
+            pos = j
+            if escaped:  # Escaped start block (without the backslash)
+                text.append((d, j))
+                continue
+            # Start of code block
+            if src[d:j].rstrip().endswith('-'):
+                self._text_rstrip = True
+            self._flush_text()
+            pos = self._parse_code(src, pos, inline)
+        if pos != n:
+            text.append((pos, n))
         self._flush_text()
 
-    def _write_line(self, line):
+    def _write_line(self, line, kind='code'):
         if line:
-            self.out.append('  ' * self._indent_cur + line)
+            self.out.append((kind, self._indent_cur, line))
         self._indent_cur += self._indent_mod  # Apply indent modification
         self._indent_mod = 0
 
+    def _join(self, spans):
+        """Materializes a list of (start, end) spans into a single string."""
+        src = self._src
+        return ''.join([src[a:b] for a, b in spans])
+
     def _flush_text(self):
-        text = ''.join(self._text)
-        if self._text_rstrip:
-            text = text.rstrip()
-            self._text_rstrip = False
+        # Fast path: flushes happen before every code region, and the
+        # buffer is frequently empty (adjacent code blocks).
+        if not self._text and not self._text_rstrip and not self._text_lstrip:
+            return
+        # Trim the buffered spans in place rather than stripping the
+        # joined text, so only the whitespace run itself is scanned.
+        spans = self._text
+        src = self._src
         if self._text_lstrip:
-            text = text.lstrip()
             self._text_lstrip = False
+            i = 0
+            while i < len(spans):
+                a, b = spans[i]
+                while a < b and src[a].isspace():
+                    a += 1
+                if a < b:
+                    spans[i] = (a, b)
+                    break
+                i += 1
+            del spans[:i]
+        if self._text_rstrip:
+            self._text_rstrip = False
+            while spans:
+                a, b = spans[-1]
+                while b > a and src[b - 1].isspace():
+                    b -= 1
+                if b > a:
+                    spans[-1] = (a, b)
+                    break
+                spans.pop()
+        text = self._join(spans)
         if text:
-            self._write_line('{0}.append({1!r})'.format(self.listname, text))
-        self._text = []
+            self._write_line(text, 'lit')
+        del spans[:]
 
-    def _parse_code(self, inline):
+    def _parse_code(self, src, pos, inline):
+        """Parses the code region at `pos`, returning the new position."""
         is_control = False
-        code_end = self.inline_end if inline else self.block_end
-        self._code = []  # Code buffer
+        inline_end = self.inline_end
+        block_end = self.block_end
+        code_end = inline_end if inline else block_end
+        code = []  # Code buffer of (start, end) spans into src
+        at_start = True  # At the start of the code region
         while True:
-            m = self.re_tok.search(self._src)
-            if not m:
+            tok = _scan_code_token(src, pos, inline_end, block_end, at_start)
+            if tok is None:
                 raise Exception('Non-terminated code block')
-            self._code.append(self._src[:m.start()])
-            self._src = self._src[m.end():]
-            _str, _com, _blk1, _blk2, _end, _cend, _nl = m.groups()
-            if (_blk1 or _blk2) and self._code and self._code[-1].strip():
+            at_start = False
+            kind, start, end = tok
+            code.append((pos, start))
+            pos = end
+            a, b = code[-1]
+            if kind in ('blk1', 'blk2') and src[a:b].strip():
                 # a if b else c
-                self._code.append(_blk1 or _blk2)
+                code.append((start, end))
                 continue
-            if _str:  # Python string
-                self._code.append(_str)
-            elif _com:  # Python comment (up to EOL)
+            if kind == 'str':  # Python string
+                code.append((start, end))
+            elif kind == 'com':  # Python comment (up to EOL)
                 # Comment can still end with block_end or inline_end
-                _com = _com.rstrip()
-                if _com.endswith(code_end):
-                    return self._end_code(inline, is_control,
-                                          _com[-len(code_end) - 1:])
-            elif _blk1:  # Start of block keyword
-                self._code.append(_blk1)
+                com = src[start:end].rstrip()
+                if com.endswith(code_end):
+                    self._end_code(inline, is_control,
+                                   com[-len(code_end) - 1:], code)
+                    return pos
+            elif kind == 'blk1':  # Start of block keyword
+                code.append((start, end))
                 is_control = True
                 if inline:
                     self._indent_mod += 1
-            elif _blk2:
-                self._code.append(_blk2)
+            elif kind == 'blk2':
+                code.append((start, end))
                 is_control = True
                 if inline:
                     self._indent_cur -= 1
                     self._indent_mod += 1
-            elif _end:
+            elif kind == 'end':
                 is_control = True
                 if inline:
                     self._indent_mod -= 1
-            elif _cend:
-                return self._end_code(inline, is_control, _cend)
-            elif _nl:
+            elif kind == 'cend':
+                self._end_code(inline, is_control, src[start:end], code)
+                return pos
+            else:  # A single newline
                 if not inline:
-                    self._write_line(''.join(self._code).rstrip())
-                    self._code = []
+                    self._write_line(self._join(code).rstrip())
+                    del code[:]
                     is_control = False
 
-    def _end_code(self, inline, is_control, cend):
-        code = ''.join(self._code)
+    def _end_code(self, inline, is_control, cend, code_spans):
+        code = self._join(code_spans)
         if inline:
             if is_control:
                 self._write_line(code.strip())
             elif code.strip():
-                tpl = '{0}.append(str(eval({1!r})))'
-                self._write_line(tpl.format(self.listname, code.strip()))
+                self._write_line(code.strip(), 'expr')
         else:
             self._write_line(code.rstrip())
         if cend.startswith('-'):
             self._text_lstrip = True
-        self._code = []
+
+
+_INDENT_CACHE = ['']
+
+
+def _indent(n):
+    """Returns the indent prefix for level `n`, growing the cache lazily."""
+    if n <= 0:  # Unbalanced 'end's can drive the level negative
+        return ''
+    while len(_INDENT_CACHE) <= n:
+        _INDENT_CACHE.append(_INDENT_CACHE[-1] + '  ')
+    return _INDENT_CACHE[n]
+
+
+# Maximum pieces folded into one `+` chain: the compiler recurses once
+# per term, so an unbounded chain overflows the stack on huge templates.
+_MAX_RUN = 100
+
+
+def _emit_append(lines, indent, run):
+    """Flushes pending append pieces `run` as a single _tempy_append call."""
+    if run:
+        lines.append(_indent(indent) +
+                     '_tempy_append({0})'.format(' + '.join(run)))
+        del run[:]
+
+
+def _generate_body(ops, listname, stream=False):
+    """Renders parser `ops` into the body lines of a template function.
+
+    Adjacent literals and inline expressions are folded into a single
+    _tempy_append call so the generated code performs one append per
+    run instead of one per piece.  With `stream`, output is written
+    directly to a `_tempy_fp` file argument instead of being collected
+    in `listname` and joined.
+    """
+    # Bind literals that occur more than once to a prologue name, so
+    # every append site shares the one string object.
+    counts = {}
+    for kind, indent, payload in ops:
+        if kind == 'lit':
+            counts[payload] = counts.get(payload, 0) + 1
+    lit_names = {}
+    lit_lines = []
+    for kind, indent, payload in ops:
+        if kind == 'lit' and counts[payload] > 1 and payload not in lit_names:
+            lit_names[payload] = '_tempy_L{0}'.format(len(lit_names))
+            lit_lines.append('{0} = {1!r}'.format(lit_names[payload], payload))
+    if not any(kind == 'code' for kind, indent, payload in ops):
+        # Straight-line template: every piece runs exactly once, so
+        # emit the concatenation directly and skip the output list.
+        lines = ['_tempy_str = str'] + lit_lines
+        run = []
+        for kind, indent, payload in ops:
+            if kind == 'lit':
+                run.append(lit_names.get(payload) or '{0!r}'.format(payload))
+            else:
+                run.append('_tempy_str(({0}))'.format(payload))
+        if stream:
+            for i in range(0, len(run), _MAX_RUN):
+                lines.append('_tempy_fp.write({0})'
+                             .format(' + '.join(run[i:i + _MAX_RUN])))
+        elif len(run) > _MAX_RUN:
+            # Too many pieces for one `+` chain; join a tuple instead,
+            # which the compiler handles without recursing per piece.
+            lines.append("return ''.join(({0}))".format(', '.join(run)))
+        else:
+            lines.append('return ' + (' + '.join(run) if run else "''"))
+        return lines
+    if stream:
+        lines = ['_tempy_append = _tempy_fp.write',
+                 '_tempy_str = str']
+    else:
+        lines = ['{0} = []'.format(listname),
+                 '_tempy_append = {0}.append'.format(listname),
+                 '_tempy_str = str']
+    lines.extend(lit_lines)
+    run = []  # Pending pieces of a single append call
+    run_indent = 0
+    for kind, indent, payload in ops:
+        if kind == 'code' or indent != run_indent:
+            _emit_append(lines, run_indent, run)
+            run_indent = indent
+        if kind == 'lit':
+            run.append(lit_names.get(payload) or '{0!r}'.format(payload))
+        elif kind == 'expr':
+            run.append('_tempy_str(({0}))'.format(payload))
+        else:
+            lines.append(_indent(indent) + payload)
+        if len(run) >= _MAX_RUN:
+            _emit_append(lines, run_indent, run)
+    _emit_append(lines, run_indent, run)
+    if not stream:
+        lines.append("return ''.join({0})".format(listname))
+    return lines
+
+
+def _cache_dir():
+    """Returns the directory used for the on-disk template cache."""
+    base = os.environ.get('XDG_CACHE_HOME')
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'tempy')
+
+
+def _compile_cached(src_py, filename):
+    """Compiles generated source, memoizing the code object on disk.
+
+    Warm runs (e.g. repeated CLI invocations on the same template) load
+    the marshalled code object instead of parsing and compiling the
+    generated source again.  Any cache trouble silently falls back to
+    compiling.
+    """
+    # The optimize level is part of the key: entries written with other
+    # compile options must not be reused.
+    key = hashlib.blake2b(('{0}\0O2\0{1}'.format(filename, src_py))
+                          .encode('utf-8'), digest_size=16).hexdigest()
+    path = os.path.join(_cache_dir(), key + '.marshal')
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data[:8] == _CACHE_HEADER:
+            return marshal.loads(data[8:])
+    except (OSError, ValueError, EOFError):
+        pass
+    # optimize=2 strips asserts and docstrings from template code for a
+    # smaller code object; dont_inherit keeps the caller's __future__
+    # imports from leaking into template compilation.
+    code = __compile(src_py, filename, 'exec', dont_inherit=True, optimize=2)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(_CACHE_HEADER + marshal.dumps(code))
+        os.replace(tmp, path)
+    except OSError:
+        pass
+    return code
+
+
+def _formatargs(args, varargs, varkw, defaults):
+    """Formats an argument list for a generated function definition."""
+    parts = list(args)
+    if defaults:
+        for i, d in enumerate(defaults):
+            j = len(parts) - len(defaults) + i
+            parts[j] = '{0}={1!r}'.format(parts[j], d)
+    if varargs:
+        parts.append('*' + varargs)
+    if varkw:
+        parts.append('**' + varkw)
+    return '(' + ', '.join(parts) + ')'
 
 
 def compile(src, name='template', args=(), varargs=None, varkw=None,
@@ -222,29 +546,101 @@ def compile(src, name='template', args=(), varargs=None, varkw=None,
     `args`. The beginning and ending tokens of blocks and inline statements
     can be set using the `block_start`, `block_end`, `inline_start` and
     `inline_end` arguments respectively.
+
+    Template code is compiled with optimization enabled, so `assert`
+    statements inside code blocks are stripped.
     """
     locals = {}
     p = Parser(block_start, block_end, inline_start, inline_end, listname)
     p.parse(src)
-    args_str = inspect.formatargspec(args, varargs, varkw, defaults)
-    out = ['def {0}{1}:'.format(name, args_str),
-           '  {0} = []'.format(listname)]
-    out.extend(['  ' + x for x in p.out])
-    out.append("  return ''.join({0})".format(listname))
-    code = __compile('\n'.join(out), filename, 'exec')
+    args_str = _formatargs(args, varargs, varkw, defaults)
+    out = ['def {0}{1}:'.format(name, args_str)]
+    out.extend(['  ' + x for x in _generate_body(p.out, listname)])
+    code = _compile_cached('\n'.join(out), filename)
     eval(code, globals(), locals)
     return locals[name]
 
 
-def render(src, **kwargs):
-    """Renders template `src` with the variables in `kwargs`."""
+def _template_vars(src_py):
+    """Classifies the names referenced by generated source `src_py`.
+
+    Returns two sorted name lists `(required, seeded)`. `required` names
+    are read but never assigned by the template, so the caller must supply
+    them. `seeded` names are assigned somewhere in the template or shadow
+    a builtin; a caller-supplied value is used as their initial value when
+    present, matching the old behavior of evaluating templates with
+    `kwargs` as locals.
+    """
+    required = set()
+    seeded = set()
+    # Skip the module-level table: at module scope every assigned name
+    # reports as global, including the template function itself.
+    func = symtable.symtable(src_py, '<string>', 'exec').get_children()[0]
+    for sym in func.get_symbols():
+        name = sym.get_name()
+        if (sym.is_local() and not sym.is_parameter()
+                and not name.startswith('_tempy_')):
+            seeded.add(name)
+    tables = [func]
+    while tables:
+        table = tables.pop()
+        for sym in table.get_symbols():
+            if sym.is_global():
+                if sym.get_name() in _BUILTIN_NAMES:
+                    seeded.add(sym.get_name())
+                else:
+                    required.add(sym.get_name())
+        tables.extend(table.get_children())
+    # `__debug__` cannot be rebound; the compiler folds it to a constant
+    # anyway, with or without a kwarg, exactly as before.
+    seeded.discard('__debug__')
+    return sorted(required), sorted(seeded - required)
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_template(src, stream=False):
+    """Compiles `src` into a function for `render()` or `render_to()`."""
     p = Parser(listname='_tempy_out')
     p.parse(src)
-    out = ['_tempy_out = []']
-    out.extend(p.out)
-    code = __compile('\n'.join(out), '<string>', 'exec')
-    eval(code, globals(), kwargs)
-    return ''.join(kwargs['_tempy_out'])
+    body = ['  ' + x for x in _generate_body(p.out, '_tempy_out', stream)]
+    argspec = '(_tempy_fp, **_tempy_kw)' if stream else '(**_tempy_kw)'
+    # Compile the body once without the argument bindings to discover
+    # which names the template needs from the keyword arguments.
+    probe = 'def _tempy_tpl{0}:\n'.format(argspec) + '\n'.join(body)
+    out = ['def _tempy_tpl{0}:'.format(argspec)]
+    required, seeded = _template_vars(probe)
+    for var in required:
+        out.append('  try: {0} = _tempy_kw[{0!r}]'.format(var))
+        out.append('  except KeyError:'
+                   ' raise NameError("name {0!r} is not defined")'.format(var))
+    for var in seeded:
+        if var in _BUILTIN_NAMES:
+            # Fall back to the builtin so the name stays usable when the
+            # caller does not supply it.
+            out.append('  {0} = _tempy_kw.get({0!r}, builtins.{0})'
+                       .format(var))
+        else:
+            out.append('  if {0!r} in _tempy_kw:'
+                       ' {0} = _tempy_kw[{0!r}]'.format(var))
+    out.extend(body)
+    locals = {}
+    code = _compile_cached('\n'.join(out), '<string>')
+    eval(code, globals(), locals)
+    return locals['_tempy_tpl']
+
+
+def render(src, **kwargs):
+    """Renders template `src` with the variables in `kwargs`."""
+    return _cached_template(src)(**kwargs)
+
+
+def render_to(fp, src, **kwargs):
+    """Renders template `src` with the variables in `kwargs` to file `fp`.
+
+    Output is written to `fp` as it is produced instead of being
+    accumulated into one string first.
+    """
+    _cached_template(src, True)(fp, **kwargs)
 
 
 def main(args):
@@ -265,7 +661,7 @@ def main(args):
         fi = sys.stdin
     else:
         fi = open(args[0], 'r')
-    fo.write(render(fi.read()))
+    render_to(fo, fi.read())
     fo.close()
     fi.close()
     return 0